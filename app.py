@@ -1,145 +1,350 @@
 import difflib
-import html
+import heapq
 import re
-from io import BytesIO
+import sys
+from collections import defaultdict
+from functools import lru_cache
+from itertools import count
 from typing import Dict, List, Tuple
 
 import streamlit as st
 
+try:
+    from rapidfuzz import fuzz as _rf_fuzz
+    from rapidfuzz.distance import Indel as _rf_indel
+except ImportError:  # pragma: no cover - optional speedup
+    _rf_fuzz = None
+    _rf_indel = None
+
 st.set_page_config(page_title="EXP Migrator: T-SQL ↔ Snowflake", layout="wide")
 
+# ----------------------------------------------------------------------
+# Compiled patterns (module-level so reruns never re-parse them)
+# ----------------------------------------------------------------------
+
+# One left-to-right pass so whichever comment opener appears first wins;
+# a `--` inside /* ... */ (or vice versa) is part of that comment, not a
+# second one. Stripping line comments before block comments is not
+# equivalent: it would eat the tail of `/* outer -- inner */`.
+_CMT_ANY = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_BRACKET = re.compile(r"\[([^\]]+)\]")
+_BACKTICK = re.compile(r"`([^`]+)`")
+# Identifiers of more than three characters; the length filter is baked
+# into the pattern so no post-filtering pass is needed.
+_WORD = re.compile(r"\b[A-Za-z_][A-Za-z0-9_]{3,}")
+_TOKEN_SPLIT = re.compile(r"(\W+)")
+_SELECT_TOP = re.compile(r"\bSELECT\s+TOP\s+(\d+)\s+", re.IGNORECASE)
+_SELECT_TOP_STRIP = re.compile(r"(\bSELECT\s+)TOP\s+\d+\s+", re.IGNORECASE)
+_LIMIT = re.compile(r"\bLIMIT\s+\d+\b", re.IGNORECASE)
+_DOUBLE_SEMI = re.compile(r";\s*;")
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9_-]+")
+
+_DIALECT_CHECKS = [
+    (re.compile(p, re.IGNORECASE), msg)
+    for p, msg in [
+        (r"\bISNULL\s*\(", "T-SQL uses `ISNULL`; Snowflake prefers `COALESCE`."),
+        (r"\bGETDATE\s*\(\s*\)", "`GETDATE()` exists only in T-SQL; map to `CURRENT_TIMESTAMP`."),
+        (r"\bLEN\s*\(", "`LEN()` should become `LENGTH()` in Snowflake."),
+        (r"\bNVARCHAR\b", "`NVARCHAR` types need to become `VARCHAR` (Snowflake stores UTF-8 by default)."),
+        (r"\bWITH\s*\(\s*NOLOCK\s*\)", "`WITH (NOLOCK)` hints are unsupported in Snowflake; remove or redesign isolation."),
+        (r"\bIDENTITY\s*\(", "`IDENTITY()` sequences must be replaced with `IDENTITY` columns or sequences in Snowflake."),
+        (r"\bTOP\s+\d+", "`TOP N` should be rewritten as `LIMIT N` (optionally with `ORDER BY`)."),
+        (r"\bMERGE\b", "Review `MERGE` syntax differences, especially `OUTPUT` clauses and semicolons."),
+        (r"\bCROSS\s*APPLY\b", "`CROSS APPLY`/`OUTER APPLY` need rewrites using `LATERAL FLATTEN` or joins in Snowflake."),
+    ]
+]
+
+
 # ----------------------------------------------------------------------
 # File + text utilities
 # ----------------------------------------------------------------------
 
+# Uploads larger than this are truncated before decoding so a stray dump
+# can't balloon memory (the bytes plus the decoded text each cost O(N)).
+MAX_SQL_BYTES = 32 * 1024 * 1024
+
+
+# UploadedFile itself isn't hashable, so the cache is keyed on the raw
+# bytes plus the filename; reruns with the same upload skip the decode.
+@st.cache_data(show_spinner=False, max_entries=8)
+def _decode_upload(data: bytes, name: str) -> str:
+    if data[:3] == b"\xef\xbb\xbf":
+        data = data[3:]
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("latin-1", errors="ignore")
+
+
+def _truncate_utf8(data: bytes, limit: int) -> bytes:
+    # A blind byte slice can land inside a multi-byte sequence, which
+    # makes the strict utf-8 decode fail and sends the whole file down
+    # the latin-1 fallback. Back up over trailing continuation bytes
+    # (10xxxxxx); if the lead byte before them promises exactly that
+    # many, the sequence is complete and the full slice is safe,
+    # otherwise drop the partial sequence. At worst one trailing
+    # character is lost.
+    if len(data) <= limit:
+        return data
+    end = limit
+    while end > 0 and data[end - 1] & 0xC0 == 0x80:
+        end -= 1
+    if end > 0 and data[end - 1] >= 0xC0:
+        lead = data[end - 1]
+        expected = 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+        if limit - end + 1 == expected:
+            return data[:limit]
+        end -= 1
+    return data[:end]
+
+
 def read_file_to_text(file) -> str:
     if not file:
         return ""
     raw = file.getvalue()
-    if isinstance(raw, bytes):
-        try:
-            return raw.decode("utf-8")
-        except Exception:
-            return raw.decode("latin-1", errors="ignore")
-    return str(raw)
+    if not isinstance(raw, bytes):
+        return str(raw)
+    if len(raw) > MAX_SQL_BYTES:
+        st.warning(
+            f"`{file.name}` is larger than {MAX_SQL_BYTES // (1024 * 1024)} MB; "
+            "only the leading portion is loaded."
+        )
+        raw = _truncate_utf8(raw, MAX_SQL_BYTES)
+    return _decode_upload(raw, file.name)
 
 
 def strip_sql_comments(sql: str) -> str:
-    sql = re.sub(r"--.*?$", "", sql, flags=re.MULTILINE)
-    sql = re.sub(r"/\*.*?\*/", "", sql, flags=re.DOTALL)
-    return sql
+    return _CMT_ANY.sub("", sql)
 
 
 def normalize_whitespace(sql: str) -> str:
-    return re.sub(r"\s+", " ", sql).strip()
+    # str.split with no arguments handles all whitespace in C and strips
+    # the ends for free; no regex machinery needed.
+    return " ".join(sql.split())
 
 
 def remove_identifier_brackets(sql: str) -> str:
-    s = re.sub(r"\[([^\]]+)\]", r"\1", sql)
-    return re.sub(r"`([^`]+)`", r"\1", s)
+    s = _BRACKET.sub(r"\1", sql)
+    return _BACKTICK.sub(r"\1", s)
+
+
+@lru_cache(maxsize=8)
+def _mapping_matcher(items: Tuple[Tuple[str, str], ...]):
+    # Longest keys first so e.g. "[dbo]." wins over "dbo.".
+    keys = sorted((k for k, _ in items), key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(k) for k in keys), re.IGNORECASE)
+    lut = {k.lower(): v for k, v in items}
+    return pattern, lut
+
+
+def _apply_mapping_items(sql: str, items: Tuple[Tuple[str, str], ...]) -> str:
+    if not items:
+        return sql
+    pattern, lut = _mapping_matcher(items)
+    return pattern.sub(lambda m: lut[m.group(0).lower()], sql)
 
 
 def apply_schema_mapping(sql: str, mapping: Dict[str, str]) -> str:
-    s = sql
-    for src, tgt in mapping.items():
-        s = re.sub(re.escape(src), tgt, s, flags=re.IGNORECASE)
-    return s
+    return _apply_mapping_items(sql, tuple(sorted(mapping.items())))
+
+
+@lru_cache(maxsize=8)
+def _norm_matcher(strip_comments_opt: bool, drop_brackets: bool, collapse_ws: bool):
+    parts = []
+    if strip_comments_opt and collapse_ws:
+        # Whole runs of whitespace and/or comments are handled together so
+        # a comment flanked by whitespace still collapses to one space.
+        parts.append(r"(?P<run>(?:\s+|--[^\n]*|/\*.*?\*/)+)")
+    elif strip_comments_opt:
+        parts.append(r"(?P<cmt>--[^\n]*|/\*.*?\*/)")
+    elif collapse_ws:
+        parts.append(r"(?P<ws>\s+)")
+    if drop_brackets:
+        parts.append(r"\[(?P<br>[^\]]+)\]")
+        parts.append(r"`(?P<bt>[^`]+)`")
+    if not parts:
+        return None
+    return re.compile("|".join(parts), re.DOTALL)
+
+
+def _norm_replacement(m: "re.Match") -> str:
+    g = m.lastgroup
+    if g == "run":
+        # A space survives only if the run held whitespace outside comments.
+        return " " if _CMT_ANY.sub("", m.group(0)) else ""
+    if g == "cmt":
+        return ""
+    if g == "ws":
+        return " "
+    return m.group(g)  # bracketed / backticked identifier body
 
 
+@st.cache_data(show_spinner=False, max_entries=32)
 def normalize_for_compare(sql: str, *, strip_comments_opt: bool, casefold: bool,
                            collapse_ws: bool, drop_brackets: bool,
-                           schema_map: Dict[str, str]) -> str:
+                           schema_map: Tuple[Tuple[str, str], ...]) -> str:
     if not sql:
         return ""
     out = sql
-    if strip_comments_opt:
-        out = strip_sql_comments(out)
-    if drop_brackets:
-        out = remove_identifier_brackets(out)
+    matcher = _norm_matcher(strip_comments_opt, drop_brackets, collapse_ws)
+    if matcher is not None:
+        out = matcher.sub(_norm_replacement, out)
     if schema_map:
-        out = apply_schema_mapping(out, schema_map)
+        out = _apply_mapping_items(out, schema_map)
     if casefold:
         out = out.lower()
     if collapse_ws:
-        out = normalize_whitespace(out)
+        out = out.strip()
     return out
 
 
 def _tokenize_for_inline(s: str) -> List[str]:
-    return re.split(r"(\W+)", s)
+    return _TOKEN_SPLIT.split(s)
+
+
+# One C-level pass instead of html.escape's chain of str.replace calls;
+# the diff path escapes every line and segment it renders.
+_HTML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"})
+
+
+def _esc(s: str) -> str:
+    return s.translate(_HTML_ESCAPE)
+
+
+def _inline_opcodes(a_toks: List[str], b_toks: List[str]):
+    if _rf_indel is not None:
+        return _rf_indel.opcodes(a_toks, b_toks)
+    # A fresh matcher per call: Streamlit serves sessions from multiple
+    # threads, so a shared instance could be mutated mid-diff. Interned
+    # tokens let SequenceMatcher's b2j dict compare keys by pointer
+    # identity instead of character-by-character.
+    sm = difflib.SequenceMatcher(autojunk=False)
+    sm.set_seq2([sys.intern(t) for t in b_toks])
+    sm.set_seq1([sys.intern(t) for t in a_toks])
+    return sm.get_opcodes()
 
 
 def inline_diff_html(a_line: str, b_line: str) -> Tuple[str, str]:
+    # Padding rows in pure insert/delete regions pass an empty line for
+    # the missing side; there is nothing to match, so skip the matcher.
+    if not b_line:
+        return (f"<span class='seg-del'>{_esc(a_line)}</span>" if a_line else ""), ""
+    if not a_line:
+        return "", f"<span class='seg-ins'>{_esc(b_line)}</span>"
+
     a_toks = _tokenize_for_inline(a_line)
     b_toks = _tokenize_for_inline(b_line)
-    sm = difflib.SequenceMatcher(None, a_toks, b_toks)
 
     a_out, b_out = [], []
-    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+    esc = _esc
+    for tag, i1, i2, j1, j2 in _inline_opcodes(a_toks, b_toks):
         if tag == "equal":
-            a_out.append(html.escape("".join(a_toks[i1:i2])))
-            b_out.append(html.escape("".join(b_toks[j1:j2])))
+            a_seg = "".join(a_toks[i1:i2])
+            b_seg = "".join(b_toks[j1:j2])
+            # Whitespace-only segments can't contain HTML specials.
+            a_out.append(a_seg if a_seg.isspace() else esc(a_seg))
+            b_out.append(b_seg if b_seg.isspace() else esc(b_seg))
         elif tag == "replace":
-            a_seg = html.escape("".join(a_toks[i1:i2]))
-            b_seg = html.escape("".join(b_toks[j1:j2]))
+            a_seg = _esc("".join(a_toks[i1:i2]))
+            b_seg = _esc("".join(b_toks[j1:j2]))
             if a_seg:
                 a_out.append(f"<span class='seg-repl'>{a_seg}</span>")
             if b_seg:
                 b_out.append(f"<span class='seg-repl'>{b_seg}</span>")
         elif tag == "delete":
-            a_seg = html.escape("".join(a_toks[i1:i2]))
+            a_seg = _esc("".join(a_toks[i1:i2]))
             if a_seg:
                 a_out.append(f"<span class='seg-del'>{a_seg}</span>")
         elif tag == "insert":
-            b_seg = html.escape("".join(b_toks[j1:j2]))
+            b_seg = _esc("".join(b_toks[j1:j2]))
             if b_seg:
                 b_out.append(f"<span class='seg-ins'>{b_seg}</span>")
     return "".join(a_out), "".join(b_out)
 
 
+@st.cache_data(show_spinner=False, max_entries=32)
+def compute_ratio(a_text: str, b_text: str) -> float:
+    if a_text == b_text:
+        return 1.0
+    if _rf_fuzz is not None:
+        return _rf_fuzz.ratio(a_text, b_text) / 100.0
+    # With whitespace collapsing on (the default) the normalized text is a
+    # single line, and a line-level ratio would be all-or-nothing; only
+    # genuinely multi-line inputs get the cheaper line-list comparison.
+    a_lines = a_text.splitlines()
+    b_lines = b_text.splitlines()
+    if len(a_lines) <= 1 or len(b_lines) <= 1:
+        return difflib.SequenceMatcher(None, a_text, b_text).ratio()
+    # SequenceMatcher degenerates toward O(n^2) on long character
+    # sequences; compare line lists instead and treat blank lines as junk.
+    return difflib.SequenceMatcher(
+        lambda line: not line.strip(),
+        a_lines,
+        b_lines,
+    ).ratio()
+
+
+def _intern_lines(a_lines: List[str], b_lines: List[str]) -> Tuple[List[int], List[int]]:
+    # SequenceMatcher hashes and compares its elements constantly; small
+    # ints make both operations single-word instead of O(line length).
+    ids: Dict[str, int] = defaultdict(count().__next__)
+    return [ids[line] for line in a_lines], [ids[line] for line in b_lines]
+
+
+_ROW_OK = "<tr><td class='ok'><pre>{}</pre></td><td class='ok'><pre>{}</pre></td></tr>".format
+_ROW_BAD = "<tr><td class='bad'><pre>{}</pre></td><td class='bad'><pre>{}</pre></td></tr>".format
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
 def side_by_side_html(a_text: str, b_text: str) -> str:
     a_lines = a_text.splitlines()
     b_lines = b_text.splitlines()
-    sm = difflib.SequenceMatcher(None, a_lines, b_lines)
 
-    rows: List[str] = []
-    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+    # Identical inputs (e.g. the same file uploaded twice) need no diff:
+    # render every line as an "ok" row directly.
+    if a_text == b_text:
+        rows = [_ROW_OK(esc, esc) for esc in (_esc(line) for line in a_lines)]
+        return _wrap_rows("\n".join(rows))
+
+    a_ids, b_ids = _intern_lines(a_lines, b_lines)
+    sm = difflib.SequenceMatcher(None, a_ids, b_ids)
+    return _wrap_rows("\n".join(_iter_rows(a_lines, b_lines, sm.get_opcodes())))
+
+
+def _iter_rows(a_lines: List[str], b_lines: List[str], opcodes):
+    esc = _esc  # LOAD_FAST in the per-line loops below
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == "equal":
-            for k in range(i2 - i1):
-                a_line = html.escape(a_lines[i1 + k])
-                b_line = html.escape(b_lines[j1 + k])
-                rows.append(
-                    "<tr>"
-                    f"<td class='ok'><pre>{a_line}</pre></td>"
-                    f"<td class='ok'><pre>{b_line}</pre></td>"
-                    "</tr>"
-                )
+            for a_line, b_line in zip(a_lines[i1:i2], b_lines[j1:j2]):
+                yield _ROW_OK(esc(a_line), esc(b_line))
         else:
             maxlen = max(i2 - i1, j2 - j1)
             for offset in range(maxlen):
                 a_line = a_lines[i1 + offset] if i1 + offset < i2 else ""
                 b_line = b_lines[j1 + offset] if j1 + offset < j2 else ""
                 a_html, b_html = inline_diff_html(a_line, b_line)
-                rows.append(
-                    "<tr>"
-                    f"<td class='bad'><pre>{a_html}</pre></td>"
-                    f"<td class='bad'><pre>{b_html}</pre></td>"
-                    "</tr>"
-                )
-
-    rows_html = "\n".join(rows)
+                yield _ROW_BAD(a_html, b_html)
+
+
+# Injected once per page render instead of being baked into every cached
+# diff table, which keeps the table HTML (and its cache entries) smaller.
+_DIFF_CSS = """
+<style>
+  table.diff { width: 100%; border-collapse: collapse; table-layout: fixed; }
+  table.diff th { background: #111; color: #fff; padding: 6px; border: 1px solid #444; }
+  table.diff td { vertical-align: top; border: 1px solid #ddd; padding: 6px; }
+  table.diff td pre { margin: 0; white-space: pre-wrap; word-break: break-word; }
+  table.diff td.ok { background: #f5fff5; }
+  table.diff td.bad { background: #ffe5e5; }
+  .seg-repl { background: rgba(255,0,0,0.2); }
+  .seg-del { background: rgba(255,0,0,0.35); text-decoration: line-through; }
+  .seg-ins { background: rgba(0,128,0,0.15); font-weight: 600; }
+</style>
+"""
+
+
+def _wrap_rows(rows_html: str) -> str:
     return f"""
-    <style>
-      table.diff {{ width: 100%; border-collapse: collapse; table-layout: fixed; }}
-      table.diff th {{ background: #111; color: #fff; padding: 6px; border: 1px solid #444; }}
-      table.diff td {{ vertical-align: top; border: 1px solid #ddd; padding: 6px; }}
-      table.diff td pre {{ margin: 0; white-space: pre-wrap; word-break: break-word; }}
-      table.diff td.ok {{ background: #f5fff5; }}
-      table.diff td.bad {{ background: #ffe5e5; }}
-      .seg-repl {{ background: rgba(255,0,0,0.2); }}
-      .seg-del {{ background: rgba(255,0,0,0.35); text-decoration: line-through; }}
-      .seg-ins {{ background: rgba(0,128,0,0.15); font-weight: 600; }}
-    </style>
     <table class="diff">
       <thead>
         <tr><th>T-SQL (normalized)</th><th>Snowflake SQL (normalized)</th></tr>
@@ -151,33 +356,23 @@ def side_by_side_html(a_text: str, b_text: str) -> str:
     """
 
 
+@st.cache_data(show_spinner=False, max_entries=32)
 def explain_differences(tsql: str, snow: str) -> List[str]:
     if not tsql or not snow:
         return []
     explanations: List[str] = []
-    checks = [
-        (r"\bISNULL\s*\(", "T-SQL uses `ISNULL`; Snowflake prefers `COALESCE`."),
-        (r"\bGETDATE\s*\(\s*\)", "`GETDATE()` exists only in T-SQL; map to `CURRENT_TIMESTAMP`."),
-        (r"\bLEN\s*\(", "`LEN()` should become `LENGTH()` in Snowflake."),
-        (r"\bNVARCHAR\b", "`NVARCHAR` types need to become `VARCHAR` (Snowflake stores UTF-8 by default)."),
-        (r"\bWITH\s*\(\s*NOLOCK\s*\)", "`WITH (NOLOCK)` hints are unsupported in Snowflake; remove or redesign isolation."),
-        (r"\bIDENTITY\s*\(", "`IDENTITY()` sequences must be replaced with `IDENTITY` columns or sequences in Snowflake."),
-        (r"\bTOP\s+\d+", "`TOP N` should be rewritten as `LIMIT N` (optionally with `ORDER BY`)."),
-        (r"\bMERGE\b", "Review `MERGE` syntax differences, especially `OUTPUT` clauses and semicolons."),
-        (r"\bCROSS\s*APPLY\b", "`CROSS APPLY`/`OUTER APPLY` need rewrites using `LATERAL FLATTEN` or joins in Snowflake."),
-    ]
-    for pattern, msg in checks:
-        if re.search(pattern, tsql, flags=re.IGNORECASE) and not re.search(pattern, snow, flags=re.IGNORECASE):
+    for pattern, msg in _DIALECT_CHECKS:
+        if pattern.search(tsql) and not pattern.search(snow):
             explanations.append(msg)
 
-    tsql_tokens = set(re.findall(r"\b[A-Za-z_][A-Za-z0-9_]*\b", tsql.lower()))
-    snow_tokens = set(re.findall(r"\b[A-Za-z_][A-Za-z0-9_]*\b", snow.lower()))
-    unique_tsql = sorted(t for t in (tsql_tokens - snow_tokens) if len(t) > 3)[:10]
+    tsql_tokens = {m.group(0).lower() for m in _WORD.finditer(tsql)}
+    snow_tokens = {m.group(0).lower() for m in _WORD.finditer(snow)}
+    unique_tsql = heapq.nsmallest(10, tsql_tokens - snow_tokens)
     if unique_tsql:
         explanations.append(
             "Tokens present only in the T-SQL EXP (check they were migrated): " + ", ".join(unique_tsql)
         )
-    unique_snow = sorted(t for t in (snow_tokens - tsql_tokens) if len(t) > 3)[:10]
+    unique_snow = heapq.nsmallest(10, snow_tokens - tsql_tokens)
     if unique_snow:
         explanations.append(
             "Tokens present only in the Snowflake EXP (verify intentional additions): " + ", ".join(unique_snow)
@@ -189,74 +384,120 @@ def explain_differences(tsql: str, snow: str) -> List[str]:
 # T-SQL → Snowflake translator
 # ----------------------------------------------------------------------
 
+# Cheap pre-scan: if none of the rewrite triggers appear, the whole
+# replacement pipeline below can be skipped.
+_ANY_REWRITE = re.compile(
+    r"--|/\*|\[|\bISNULL\s*\(|\bGETDATE\s*\(|\bLEN\s*\(|\bDATEDIFF\s*\(|\bNVARCHAR\b"
+    r"|\bWITH\s*\(\s*NOLOCK\s*\)|\bCONVERT\s*\(|\bSELECT\s+TOP\s+\d+",
+    re.IGNORECASE,
+)
+
+# Every rewrite except TOP->LIMIT (which appends text at the end of the
+# statement) fused into one alternation, so the SQL is scanned once
+# instead of once per rule.
+_TSQL_REWRITE = re.compile(
+    r"(?P<isnull>\bISNULL\s*\()"
+    r"|(?P<getdate>\bGETDATE\s*\(\s*\))"
+    r"|(?P<len>\bLEN\s*\()"
+    r"|(?P<nvarchar>\bNVARCHAR\b)"
+    r"|(?P<datediff>\bDATEDIFF\s*\()"
+    r"|(?P<nolock>\bWITH\s*\(\s*NOLOCK\s*\))"
+    r"|(?P<convert>\bCONVERT\s*\(\s*(?P<ctype>[A-Za-z0-9_]+)\s*,\s*(?P<cexpr>.*?)\))"
+    r"|(?P<bracket>\[(?P<bname>[^\]]+)\])",
+    re.IGNORECASE,
+)
+
+_TSQL_NOTES = [
+    ("bracket", "Converted `[identifier]` to double-quoted identifiers."),
+    ("isnull", "Replaced ISNULL with COALESCE."),
+    ("getdate", "Replaced GETDATE() with CURRENT_TIMESTAMP."),
+    ("len", "Replaced LEN() with LENGTH()."),
+    ("nvarchar", "Replaced NVARCHAR with VARCHAR."),
+    ("datediff", "Check DATEDIFF order: Snowflake expects (unit, start, end)."),
+    ("nolock", "Removed WITH (NOLOCK) hints; Snowflake handles isolation differently."),
+    ("convert", "Converted CONVERT(...) to CAST(... AS ...)."),
+]
+
+
 def t_sql_to_snowflake(tsql: str, schema_map: Dict[str, str]) -> Tuple[str, List[str]]:
     notes: List[str] = []
     s = tsql
 
-    before = s
-    s = strip_sql_comments(s)
-    if s != before:
-        notes.append("Removed T-SQL comments.")
-
-    def _bracket_to_quoted(match: re.Match) -> str:
-        return f'"{match.group(1)}"'
-
-    before = s
-    s = re.sub(r"\[([^\]]+)\]", _bracket_to_quoted, s)
-    if s != before:
-        notes.append("Converted `[identifier]` to double-quoted identifiers.")
-
-    replacements = [
-        (r"\bISNULL\s*\(", "COALESCE(", "Replaced ISNULL with COALESCE."),
-        (r"\bGETDATE\s*\(\s*\)", "CURRENT_TIMESTAMP", "Replaced GETDATE() with CURRENT_TIMESTAMP."),
-        (r"\bLEN\s*\(", "LENGTH(", "Replaced LEN() with LENGTH()."),
-        (r"\bDATEDIFF\s*\(", "DATEDIFF(", "Check DATEDIFF order: Snowflake expects (unit, start, end)."),
-    ]
-    for pattern, repl, msg in replacements:
-        new_s = re.sub(pattern, repl, s, flags=re.IGNORECASE)
-        if new_s != s:
+    if not schema_map and not _ANY_REWRITE.search(s):
+        if ";" in s:
+            s = _DOUBLE_SEMI.sub(";", s)
+        return normalize_whitespace(s), notes
+
+    # One membership check is a C-level memchr; far cheaper than letting
+    # the comment patterns scan clean SQL.
+    if "--" in s or "/*" in s:
+        s, n_cmt = _CMT_ANY.subn("", s)
+        if n_cmt:
+            notes.append("Removed T-SQL comments.")
+
+    fired: set = set()
+
+    def _rewrite(match: re.Match) -> str:
+        if match.group("isnull") is not None:
+            fired.add("isnull")
+            return "COALESCE("
+        if match.group("getdate") is not None:
+            fired.add("getdate")
+            return "CURRENT_TIMESTAMP"
+        if match.group("len") is not None:
+            fired.add("len")
+            return "LENGTH("
+        if match.group("nvarchar") is not None:
+            fired.add("nvarchar")
+            return "VARCHAR"
+        if match.group("datediff") is not None:
+            fired.add("datediff")
+            return match.group(0)
+        if match.group("nolock") is not None:
+            fired.add("nolock")
+            return ""
+        if match.group("convert") is not None:
+            fired.add("convert")
+            dtype = match.group("ctype").strip()
+            # The CONVERT arguments may themselves contain rewritable
+            # constructs (e.g. bracketed identifiers); recurse on them.
+            expr = _TSQL_REWRITE.sub(_rewrite, match.group("cexpr").strip())
+            return f"CAST({expr} AS {dtype})"
+        fired.add("bracket")
+        return f'"{match.group("bname")}"'
+
+    s = _TSQL_REWRITE.sub(_rewrite, s)
+    for key, msg in _TSQL_NOTES:
+        if key in fired:
             notes.append(msg)
-            s = new_s
-
-    before = s
-    s = re.sub(r"\bWITH\s*\(\s*NOLOCK\s*\)", "", s, flags=re.IGNORECASE)
-    if s != before:
-        notes.append("Removed WITH (NOLOCK) hints; Snowflake handles isolation differently.")
-
-    def _convert_to_cast(match: re.Match) -> str:
-        dtype = match.group(1).strip()
-        expr = match.group(2).strip()
-        return f"CAST({expr} AS {dtype})"
 
-    before = s
-    s = re.sub(r"\bCONVERT\s*\(\s*([A-Za-z0-9_]+)\s*,\s*(.*?)\)", _convert_to_cast, s, flags=re.IGNORECASE)
-    if s != before:
-        notes.append("Converted CONVERT(...) to CAST(... AS ...).")
-
-    top_match = re.search(r"\bSELECT\s+TOP\s+(\d+)\s+", s, flags=re.IGNORECASE)
+    top_match = _SELECT_TOP.search(s)
     if top_match:
         n = top_match.group(1)
-        s = re.sub(r"(\bSELECT\s+)TOP\s+\d+\s+", r"\1", s, flags=re.IGNORECASE)
-        if not re.search(r"\bLIMIT\s+\d+\b", s, flags=re.IGNORECASE):
+        s = _SELECT_TOP_STRIP.sub(r"\1", s)
+        if not _LIMIT.search(s):
             s = s.rstrip(" ;\n") + f"\nLIMIT {n};"
         notes.append(f"Translated TOP {n} to LIMIT {n}.")
 
     if schema_map:
-        before = s
-        s = apply_schema_mapping(s, schema_map)
-        if s != before:
+        pattern, lut = _mapping_matcher(tuple(sorted(schema_map.items())))
+        s, n_mapped = pattern.subn(lambda m: lut[m.group(0).lower()], s)
+        if n_mapped:
             notes.append("Applied schema/schema-prefix mapping.")
 
-    s = re.sub(r";\s*;", ";", s)
+    if ";" in s:
+        s = _DOUBLE_SEMI.sub(";", s)
     s = normalize_whitespace(s)
     return s, notes
 
 
-def make_download(data: str, filename: str) -> BytesIO:
-    buf = BytesIO()
-    buf.write(data.encode("utf-8"))
-    buf.seek(0)
-    return buf
+@st.cache_data(show_spinner=False, max_entries=16)
+def _translate(tsql: str, schema_map_items: Tuple[Tuple[str, str], ...]) -> Tuple[str, List[str]]:
+    return t_sql_to_snowflake(tsql, dict(schema_map_items))
+
+
+def make_download(data: str) -> bytes:
+    return data.encode("utf-8")
 
 
 # ----------------------------------------------------------------------
@@ -282,12 +523,23 @@ with st.sidebar:
     st.markdown("---")
     threshold = st.slider("Alert threshold (congruence %)", 50, 100, 95, 1)
 
-schema_map: Dict[str, str] = {}
-for line in mapping_text.splitlines():
-    if "->" in line:
-        left, right = line.split("->", 1)
-        schema_map[left.strip()] = right.strip()
+@st.cache_data(show_spinner=False)
+def _parse_mapping(text: str) -> Dict[str, str]:
+    mapping: Dict[str, str] = {}
+    for line in text.splitlines():
+        if "->" in line:
+            left, right = line.split("->", 1)
+            mapping[left.strip()] = right.strip()
+    return mapping
+
 
+schema_map: Dict[str, str] = _parse_mapping(mapping_text)
+
+# Hashable form of the mapping so cached helpers can key on it.
+schema_map_items: Tuple[Tuple[str, str], ...] = tuple(sorted(schema_map.items()))
+
+
+st.markdown(_DIFF_CSS, unsafe_allow_html=True)
 
 compare_tab, translate_tab = st.tabs([
     "Compare EXPs",
@@ -323,7 +575,7 @@ with compare_tab:
             casefold=case_insensitive,
             collapse_ws=collapse_ws,
             drop_brackets=drop_brackets,
-            schema_map=schema_map,
+            schema_map=schema_map_items,
         )
         norm_snow = normalize_for_compare(
             raw_snow,
@@ -331,33 +583,45 @@ with compare_tab:
             casefold=case_insensitive,
             collapse_ws=collapse_ws,
             drop_brackets=drop_brackets,
-            schema_map=schema_map,
+            schema_map=schema_map_items,
         )
 
-        ratio = difflib.SequenceMatcher(None, norm_tsql, norm_snow).ratio()
-        score = round(100.0 * ratio, 2)
+        # Identical after normalization: nothing for the diff machinery to do.
+        if norm_tsql == norm_snow:
+            score = 100.0
+            table_html = ""
+            diff_text = ""
+            explanations = []
+        else:
+            ratio = compute_ratio(norm_tsql, norm_snow)
+            score = round(100.0 * ratio, 2)
+            table_html = side_by_side_html(norm_tsql, norm_snow)
+            diff_lines = difflib.unified_diff(
+                norm_tsql.splitlines(),
+                norm_snow.splitlines(),
+                fromfile="TSQL (normalized)",
+                tofile="Snowflake (normalized)",
+                lineterm="",
+            )
+            diff_text = "\n".join(diff_lines)
+            explanations = explain_differences(raw_tsql, raw_snow)
+
         st.metric("Congruence Score", f"{score:.2f}%")
         status = "✅ Within threshold" if score >= threshold else "⚠️ Below threshold"
         st.write(f"**Status:** {status} (threshold = {threshold}%)")
 
         st.markdown("#### Difference Heatmap (normalized)")
-        st.markdown(side_by_side_html(norm_tsql, norm_snow), unsafe_allow_html=True)
+        if table_html:
+            st.markdown(table_html, unsafe_allow_html=True)
+        else:
+            st.success("No differences detected after normalization.")
 
         st.markdown("#### Unified Diff Snapshot")
-        diff_lines = difflib.unified_diff(
-            norm_tsql.splitlines(),
-            norm_snow.splitlines(),
-            fromfile="TSQL (normalized)",
-            tofile="Snowflake (normalized)",
-            lineterm="",
-        )
-        diff_text = "\n".join(diff_lines)
         if diff_text.strip():
             st.code(diff_text, language="diff")
         else:
             st.success("No differences detected after normalization.")
 
-        explanations = explain_differences(raw_tsql, raw_snow)
         if explanations:
             st.markdown("#### Why do they differ?")
             for item in explanations:
@@ -375,16 +639,16 @@ with compare_tab:
                 st.code(raw_snow, language="sql")
 
         st.markdown("#### Snowflake translation from the T-SQL EXP")
-        translated_sql, translate_notes = t_sql_to_snowflake(raw_tsql, schema_map)
+        translated_sql, translate_notes = _translate(raw_tsql, schema_map_items)
         st.code(translated_sql, language="sql")
 
         download_name = "translated_from_tsql.sql"
         if tsql_file and tsql_file.name:
-            base_name = re.sub(r"[^A-Za-z0-9_-]+", "_", tsql_file.name.rsplit(".", 1)[0]) or "translated_from_tsql"
+            base_name = _SAFE_NAME.sub("_", tsql_file.name.rsplit(".", 1)[0]) or "translated_from_tsql"
             download_name = f"{base_name}_snowflake.sql"
         st.download_button(
             label="⬇️ Download translated Snowflake EXP",
-            data=make_download(translated_sql, download_name),
+            data=make_download(translated_sql),
             file_name=download_name,
             mime="text/sql",
             key="compare_translation_download",
@@ -417,14 +681,14 @@ with translate_tab:
         if not source_sql.strip():
             st.warning("Please upload or paste a T-SQL EXP to translate.")
         else:
-            translated_sql, notes = t_sql_to_snowflake(source_sql, schema_map)
+            translated_sql, notes = _translate(source_sql, schema_map_items)
             st.markdown("#### Translated Snowflake EXP")
             st.code(translated_sql, language="sql")
 
             download_name = "translated_snowflake.sql"
             st.download_button(
                 label="⬇️ Download Snowflake EXP",
-                data=make_download(translated_sql, download_name),
+                data=make_download(translated_sql),
                 file_name=download_name,
                 mime="text/sql",
                 use_container_width=True,